@@ -1,24 +1,76 @@
 # Jules-Style Agent API (FastAPI Wrapper)
 
-from fastapi import FastAPI, BackgroundTasks
-from pydantic import BaseModel
+from fastapi import FastAPI, HTTPException, Response
+from pydantic import BaseModel, ConfigDict, PrivateAttr, model_validator
 import uuid
-import subprocess
+import asyncio
 import os
-import requests
-from typing import Optional
+import httpx
+from typing import Optional, Tuple
 import json
+import msgpack
 import shutil
+import tempfile
+import fcntl
+import time
+import threading
+import re
+from contextlib import asynccontextmanager, contextmanager
 from pathlib import Path
 
-app = FastAPI()
-
 # Storage configuration - supports multiple backends
-STORAGE_TYPE = os.getenv("STORAGE_TYPE", "file")  # file, redis, memory
-TASKS_FILE = os.getenv("TASKS_FILE", "/app/data/tasks.json")  # Changed to persistent volume
+# Defaults to redis whenever REDIS_URL is provided, otherwise file
+STORAGE_TYPE = os.getenv("STORAGE_TYPE") or ("redis" if os.getenv("REDIS_URL") else "file")  # file, redis, memory
+TASKS_FILE = os.getenv("TASKS_FILE", "/app/data/tasks.msgpack")  # Changed to persistent volume
 REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379")
-
-# In-memory fallback for development
+REDIS_MAX_CONNECTIONS = int(os.getenv("REDIS_MAX_CONNECTIONS", "50"))
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "1"))  # uvicorn worker processes
+TASKS_LOCK_FILE = f"{TASKS_FILE}.lock"  # Sidecar lock serializing file read-modify-write
+TASKS_LOG = os.getenv("TASKS_LOG", os.path.join(os.path.dirname(TASKS_FILE), "tasks.log"))  # Append-only journal of task patches
+LEGACY_TASKS_FILE = os.path.join(os.path.dirname(TASKS_FILE), "tasks.json")  # Pre-msgpack default, migrated on startup
+TASKS_FSYNC = os.getenv("TASKS_FSYNC", "everysec")  # always, everysec, no
+STORAGE_DURABILITY = os.getenv("STORAGE_DURABILITY", "strict")  # strict, relaxed (skip snapshot fsyncs)
+TASKS_FLUSH_INTERVAL = float(os.getenv("TASKS_FLUSH_INTERVAL", "1.0"))  # Seconds between write-behind flushes
+
+# Journal compaction: rewrite the snapshot once the log outgrows it this many times
+LOG_COMPACT_RATIO = 10
+LOG_COMPACT_MIN_BYTES = 1 << 20
+
+# Redis key layout: one hash per task plus a set of running task ids
+TASK_KEY_PREFIX = "jules:task:"
+RUNNING_TASKS_KEY = "jules:tasks:running"
+FINISHED_TASKS_KEY = "jules:tasks:finished"  # Most recently finished task ids, newest first
+FINISHED_TASKS_LIMIT = 1000
+INVALIDATE_CHANNEL = "jules:invalidate"  # Pub/sub channel telling workers to drop cached tasks
+
+# How long a cached /task-status answer may be served without re-reading storage
+STATUS_CACHE_TTL = float(os.getenv("STATUS_CACHE_TTL", "0.25"))
+STATUS_CACHE_MAX = 10000  # Entries held at most; at this short a TTL, dropping them all is cheap
+
+# GitHub credentials, read once at import
+GITHUB_TOKEN = os.getenv("GITHUB_TOKEN")
+GITHUB_AUTH_HEADERS = {"Authorization": f"token {GITHUB_TOKEN}"} if GITHUB_TOKEN else {}
+
+GITHUB_API_URL = "https://api.github.com"
+GITHUB_GRAPHQL_PATH = "/graphql"
+
+# Optional PR enrichment, comma-separated label names / reviewer logins
+GITHUB_PR_LABELS = [l.strip() for l in os.getenv("GITHUB_PR_LABELS", "").split(",") if l.strip()]
+GITHUB_PR_REVIEWERS = [r.strip() for r in os.getenv("GITHUB_PR_REVIEWERS", "").split(",") if r.strip()]
+
+GITHUB_REPO_URL_PREFIX = "https://github.com/"
+# https://github.com/<owner>/<repo>[.git][/] -> "<owner>/<repo>", segments limited to GitHub's name characters
+GITHUB_REPO_URL_RE = re.compile(r"^https://github\.com/([A-Za-z0-9_.-]+/[A-Za-z0-9_.-]+?)(?:\.git)?/?$")
+
+# Agent work queue: a fixed pool of worker coroutines drains it, so bursts queue up instead of piling on
+AGENT_WORKERS = int(os.getenv("AGENT_WORKERS", "4"))
+AGENT_QUEUE_SIZE = int(os.getenv("AGENT_QUEUE_SIZE", "1000"))
+# Created per lifespan: an asyncio.Queue binds to the first event loop that waits on it
+AGENT_QUEUE: Optional[asyncio.Queue] = None
+_agent_workers = []
+_in_flight_tasks = set()  # Task ids a worker has picked up but not finished
+
+# In-memory task map: the development backend, and the warm mirror behind file storage
 _memory_tasks = {}
 
 class TaskStorage:
@@ -27,182 +79,684 @@ class TaskStorage:
     def __init__(self):
         self.storage_type = STORAGE_TYPE
         self.redis_client = None
+        self._status_cache = {}  # task_id -> (fetched_at, task)
+        self._log_fd = None
+        self._log_size = 0  # Journal and snapshot sizes tracked in memory so idle flushes never stat
+        self._snapshot_size = 0
+        self._pending = []  # Journal lines applied in memory but not yet written (write-behind)
+        self._mirror_lock = threading.Lock()
+        self._flush_task = None
         
         # Initialize Redis if specified
         if self.storage_type == "redis":
             try:
                 import redis
-                self.redis_client = redis.from_url(REDIS_URL)
+                pool = redis.ConnectionPool.from_url(
+                    REDIS_URL, max_connections=REDIS_MAX_CONNECTIONS, decode_responses=True
+                )
+                self.redis_client = redis.Redis(connection_pool=pool)
                 # Test connection
                 self.redis_client.ping()
                 print(f"[STORAGE] Connected to Redis at {REDIS_URL}")
+                self._subscribe_invalidations()
             except Exception as e:
                 print(f"[STORAGE WARNING] Redis connection failed: {e}. Falling back to file storage.")
                 self.storage_type = "file"
         
+        # File and memory state live in one process; extra workers would silently diverge
+        if WEB_CONCURRENCY > 1 and self.storage_type != "redis":
+            raise RuntimeError("Use STORAGE_TYPE=redis with multi-worker deployments")
+        
         # Ensure data directory exists for file storage
         if self.storage_type == "file":
             Path(TASKS_FILE).parent.mkdir(parents=True, exist_ok=True)
-            print(f"[STORAGE] Using file storage at {TASKS_FILE}")
+            Path(TASKS_LOG).parent.mkdir(parents=True, exist_ok=True)
+            self._open_journal()
+            print(f"[STORAGE] Using file storage at {TASKS_FILE} (journal {TASKS_LOG}, fsync={TASKS_FSYNC})")
         elif self.storage_type == "memory":
             print(f"[STORAGE] Using in-memory storage (not persistent)")
     
-    def load_tasks(self):
-        """Load tasks from storage backend"""
+    def _subscribe_invalidations(self):
+        """Drop cached tasks when another worker publishes a write"""
         try:
-            if self.storage_type == "redis" and self.redis_client:
-                data = self.redis_client.get("jules_tasks")
-                return json.loads(data) if data else {}
-            elif self.storage_type == "file":
-                if os.path.exists(TASKS_FILE):
-                    with open(TASKS_FILE, "r") as f:
-                        return json.load(f)
-                return {}
-            else:  # memory
-                return _memory_tasks.copy()
+            pubsub = self.redis_client.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(**{INVALIDATE_CHANNEL: lambda message: self._status_cache.pop(message["data"], None)})
+            pubsub.run_in_thread(sleep_time=1, daemon=True)
         except Exception as e:
-            print(f"[STORAGE ERROR] Failed to load tasks: {e}")
-            return {}
+            print(f"[STORAGE WARNING] Cache invalidation subscription failed: {e}")
+    
+    def _use_redis(self):
+        return self.storage_type == "redis" and self.redis_client is not None
+    
+    def _hset_task(self, pipe, task_id, fields):
+        """Queue writes of fields into a task's Redis hash on pipe (None values delete the field)"""
+        key = f"{TASK_KEY_PREFIX}{task_id}"
+        mapping = {k: v for k, v in fields.items() if v is not None}
+        cleared = [k for k, v in fields.items() if v is None]
+        if mapping:
+            pipe.hset(key, mapping=mapping)
+        if cleared:
+            pipe.hdel(key, *cleared)
+        status = fields.get("status")
+        if status == "running":
+            pipe.sadd(RUNNING_TASKS_KEY, task_id)
+        elif status is not None:
+            pipe.srem(RUNNING_TASKS_KEY, task_id)
+            pipe.lpush(FINISHED_TASKS_KEY, task_id)
+            pipe.ltrim(FINISHED_TASKS_KEY, 0, FINISHED_TASKS_LIMIT - 1)
+        pipe.publish(INVALIDATE_CHANNEL, task_id)
+    
+    def get_task(self, task_id):
+        """Fetch a single task record, or None if it does not exist"""
+        try:
+            if self._use_redis():
+                data = self.redis_client.hgetall(f"{TASK_KEY_PREFIX}{task_id}")
+                if not data:
+                    return None
+                return {"status": data.get("status"), "result": data.get("result")}
+            # file and memory both serve from the in-memory mirror
+            with self._mirror_lock:
+                task = _memory_tasks.get(task_id)
+                return dict(task) if task is not None else None
+        except Exception as e:
+            print(f"[STORAGE ERROR] Failed to load task {task_id}: {e}")
+            return None
+    
+    @contextmanager
+    def _file_lock(self):
+        """Hold an exclusive cross-process lock on the tasks file"""
+        fd = os.open(TASKS_LOCK_FILE, os.O_CREAT | os.O_RDWR)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            yield
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
+    
+    def _read_snapshot(self):
+        if os.path.exists(TASKS_FILE):
+            with open(TASKS_FILE, "rb") as f:
+                data = f.read()
+            self._snapshot_size = len(data)
+            if data.lstrip().startswith(b"{"):  # Legacy JSON tasks file
+                return json.loads(data)
+            return msgpack.unpackb(data, raw=False) if data else {}
+        if os.path.exists(LEGACY_TASKS_FILE):
+            # Tasks from before the msgpack default; the caller rewrites them as a snapshot
+            print(f"[STORAGE] Migrating tasks from {LEGACY_TASKS_FILE} to {TASKS_FILE}")
+            with open(LEGACY_TASKS_FILE, "r") as f:
+                return json.load(f)
+        return {}
+    
+    def _write_snapshot(self, tasks):
+        # Atomic write to prevent corruption; caller holds the file lock
+        durable = STORAGE_DURABILITY != "relaxed"
+        temp_file = f"{TASKS_FILE}.tmp"
+        data = msgpack.packb(tasks, use_bin_type=True)
+        with open(temp_file, "wb") as f:
+            f.write(data)
+            if durable:
+                # Content must be on disk before the rename can expose it
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(temp_file, TASKS_FILE)  # Atomic rename
+        if durable:
+            # Persist the rename itself
+            dir_fd = os.open(os.path.dirname(os.path.abspath(TASKS_FILE)), os.O_DIRECTORY)
+            try:
+                os.fsync(dir_fd)
+            finally:
+                os.close(dir_fd)
+        self._snapshot_size = len(data)
     
-    def save_tasks(self, tasks):
-        """Save tasks to storage backend"""
+    def _open_journal(self):
+        """Load snapshot + journal into memory once at startup, then compact"""
+        with self._file_lock():
+            migrating = not os.path.exists(TASKS_FILE) and os.path.exists(LEGACY_TASKS_FILE)
+            _memory_tasks.update(self._read_snapshot())
+            if os.path.exists(TASKS_LOG):
+                with open(TASKS_LOG, "r") as f:
+                    for line in f:
+                        try:
+                            entry = json.loads(line)
+                        except ValueError:
+                            break  # Torn final write from a crash
+                        _memory_tasks.setdefault(entry.pop("id"), {}).update(entry)
+            self._log_fd = os.open(TASKS_LOG, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            self._log_size = os.fstat(self._log_fd).st_size
+            self._compact_journal(force=migrating)
+    
+    def _compact_journal(self, force: bool = False):
+        """Fold the journal into a fresh snapshot and truncate it; caller holds the file lock"""
+        if self._log_size == 0 and not force:
+            return
+        with self._mirror_lock:
+            tasks = {task_id: dict(task) for task_id, task in _memory_tasks.items()}
+        self._write_snapshot(tasks)
+        os.ftruncate(self._log_fd, 0)
+        self._log_size = 0
+    
+    def flush(self):
+        """Write pending journal lines to disk, compacting if the journal outgrew the snapshot"""
+        if self.storage_type != "file" or not self._pending:
+            return  # Idle ticks touch neither the disk nor the file lock
+        with self._file_lock():
+            with self._mirror_lock:
+                lines, self._pending = self._pending, []
+            if lines:
+                data = "".join(lines).encode()
+                os.write(self._log_fd, data)
+                self._log_size += len(data)
+                if TASKS_FSYNC != "no":
+                    os.fsync(self._log_fd)
+            if self._log_size > max(LOG_COMPACT_RATIO * self._snapshot_size, LOG_COMPACT_MIN_BYTES):
+                self._compact_journal()
+    
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(TASKS_FLUSH_INTERVAL)
+            try:
+                await asyncio.to_thread(self.flush)
+            except Exception as e:
+                print(f"[STORAGE ERROR] Write-behind flush failed: {e}")
+    
+    def start_flusher(self):
+        """Start the background write-behind flush (file storage only)"""
+        if self.storage_type == "file" and self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_loop())
+    
+    async def stop_flusher(self):
+        """Stop the background flush and persist anything still pending"""
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+        await asyncio.to_thread(self.flush)
+    
+    def upsert(self, task_id, patch):
+        """Atomically merge patch into a task record, creating it if needed"""
         try:
-            if self.storage_type == "redis" and self.redis_client:
-                self.redis_client.set("jules_tasks", json.dumps(tasks))
+            if self._use_redis():
+                # One round-trip for the hash, the running/finished bookkeeping and the invalidation
+                pipe = self.redis_client.pipeline(transaction=False)
+                self._hset_task(pipe, task_id, patch)
+                pipe.execute()
             elif self.storage_type == "file":
-                # Atomic write to prevent corruption
-                temp_file = f"{TASKS_FILE}.tmp"
-                with open(temp_file, "w") as f:
-                    json.dump(tasks, f, indent=2)
-                os.replace(temp_file, TASKS_FILE)  # Atomic rename
+                with self._mirror_lock:
+                    _memory_tasks.setdefault(task_id, {}).update(patch)
+                    self._pending.append(json.dumps({"id": task_id, **patch}) + "\n")
+                if TASKS_FSYNC == "always":
+                    self.flush()
             else:  # memory
-                _memory_tasks.clear()
-                _memory_tasks.update(tasks)
+                with self._mirror_lock:
+                    _memory_tasks.setdefault(task_id, {}).update(patch)
+            self._status_cache.pop(task_id, None)
+        except Exception as e:
+            print(f"[STORAGE ERROR] Failed to save task {task_id}: {e}")
+    
+    def get_task_cached(self, task_id):
+        """Like get_task, but serves repeated Redis polls from memory for STATUS_CACHE_TTL seconds"""
+        if not self._use_redis():
+            return self.get_task(task_id)  # Memory and file reads already come from the in-process map
+        cached = self._status_cache.get(task_id)
+        now = time.monotonic()
+        if cached and now - cached[0] < STATUS_CACHE_TTL:
+            return cached[1]
+        self._status_cache.pop(task_id, None)  # Stale; never leave it behind for a task that vanished
+        task = self.get_task(task_id)
+        if task is not None:
+            if len(self._status_cache) >= STATUS_CACHE_MAX:
+                self._status_cache.clear()
+            self._status_cache[task_id] = (now, task)
+        return task
+    
+    def load_tasks(self):
+        """Load all tasks from storage backend"""
+        try:
+            if self._use_redis():
+                keys = list(self.redis_client.scan_iter(match=f"{TASK_KEY_PREFIX}*"))
+                pipe = self.redis_client.pipeline(transaction=False)
+                for key in keys:
+                    pipe.hgetall(key)
+                return {
+                    key[len(TASK_KEY_PREFIX):]: {"status": data.get("status"), "result": data.get("result")}
+                    for key, data in zip(keys, pipe.execute())
+                }
+            else:  # file and memory both serve from the in-memory mirror
+                with self._mirror_lock:
+                    return {task_id: dict(task) for task_id, task in _memory_tasks.items()}
         except Exception as e:
-            print(f"[STORAGE ERROR] Failed to save tasks: {e}")
+            print(f"[STORAGE ERROR] Failed to load tasks: {e}")
+            return {}
 
 # Initialize storage
 task_storage = TaskStorage()
 
-def load_tasks():
-    return task_storage.load_tasks()
 
-def save_tasks(tasks):
-    task_storage.save_tasks(tasks)
+# One long-lived GitHub API client: every PR call multiplexes over the same HTTP/2 connection
+github_client: Optional[httpx.AsyncClient] = None
+
+
+async def open_github_client():
+    global github_client
+    github_client = httpx.AsyncClient(
+        http2=True,
+        base_url=GITHUB_API_URL,
+        headers={"Accept": "application/vnd.github+json", **GITHUB_AUTH_HEADERS},
+        timeout=httpx.Timeout(30.0),
+    )
+
+
+async def close_github_client():
+    if github_client is not None:
+        await github_client.aclose()
 
 
 class TaskRequest(BaseModel):
+    model_config = ConfigDict(frozen=True, str_strip_whitespace=True)
+
     prompt: str
     github_repo_url: str
     github_branch: Optional[str] = "main"
     test_command: Optional[str] = None  # e.g., "pytest" or "npm test"
 
-
-@app.post("/start-task")
-def start_task(req: TaskRequest, background_tasks: BackgroundTasks):
+    _owner_repo: str = PrivateAttr(default="")
+    _test_args: Tuple[str, ...] = PrivateAttr(default=())
+
+    @model_validator(mode="after")
+    def _derive_fields(self):
+        match = GITHUB_REPO_URL_RE.match(self.github_repo_url)
+        # owner_repo ends up in filesystem paths (the repo cache), so "."/".." must never pass
+        if not match or any(part in (".", "..") or part.endswith(".git") for part in match.group(1).split("/")):
+            raise ValueError("github_repo_url must look like https://github.com/<owner>/<repo>[.git]")
+        self._owner_repo = match.group(1)
+        self._test_args = tuple(self.test_command.split()) if self.test_command else ()
+        return self
+
+    @property
+    def owner_repo(self) -> str:
+        """'<owner>/<repo>' parsed from github_repo_url at validation time"""
+        return self._owner_repo
+
+    @property
+    def test_args(self) -> Tuple[str, ...]:
+        """test_command split into argv once at validation time (empty if none)"""
+        return self._test_args
+
+
+async def _agent_worker():
+    while True:
+        task_id, req = await AGENT_QUEUE.get()
+        _in_flight_tasks.add(task_id)
+        try:
+            await run_agent(task_id, req)
+            _in_flight_tasks.discard(task_id)  # Left in place if cancelled, so shutdown can fail it
+        finally:
+            AGENT_QUEUE.task_done()
+
+
+async def start_agent_workers():
+    global AGENT_QUEUE
+    AGENT_QUEUE = asyncio.Queue(maxsize=AGENT_QUEUE_SIZE)
+    _agent_workers.clear()
+    _in_flight_tasks.clear()
+    _repo_cache_locks.clear()  # Locks bind to a loop too
+    for _ in range(AGENT_WORKERS):
+        _agent_workers.append(asyncio.create_task(_agent_worker()))
+
+
+async def stop_agent_workers():
+    """Cancel the pool and fail every task it will no longer finish"""
+    for worker in _agent_workers:
+        worker.cancel()
+    await asyncio.gather(*_agent_workers, return_exceptions=True)
+    _agent_workers.clear()
+
+    aborted = set(_in_flight_tasks)
+    _in_flight_tasks.clear()
+    while not AGENT_QUEUE.empty():
+        task_id, _ = AGENT_QUEUE.get_nowait()
+        AGENT_QUEUE.task_done()
+        aborted.add(task_id)
+    for task_id in aborted:
+        await asyncio.to_thread(task_storage.upsert, task_id, {"status": "failed", "result": "Aborted by shutdown"})
+    if aborted:
+        print(f"[AGENT] Marked {len(aborted)} unfinished task(s) failed on shutdown")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Workers start last and stop first, so the GitHub client and storage outlive
+    # every task; the final flush then also persists the tasks aborted above
+    task_storage.start_flusher()
+    await open_github_client()
+    await start_agent_workers()
+    yield
+    await stop_agent_workers()
+    await close_github_client()
+    await task_storage.stop_flusher()
+
+
+app = FastAPI(lifespan=lifespan)
+
+
+@app.post("/start-task", status_code=202)
+async def start_task(req: TaskRequest):
+    if AGENT_QUEUE.full():
+        raise HTTPException(status_code=503, detail="Agent queue is full, retry later")
     task_id = str(uuid.uuid4())
-    tasks = load_tasks()
-    tasks[task_id] = {"status": "running", "result": None}
-    save_tasks(tasks)
-    background_tasks.add_task(run_agent, task_id, req)
+    await asyncio.to_thread(task_storage.upsert, task_id, {"status": "running", "result": None})
+    try:
+        AGENT_QUEUE.put_nowait((task_id, req))
+    except asyncio.QueueFull:  # Filled up while the record was being written
+        await asyncio.to_thread(task_storage.upsert, task_id, {"status": "failed", "result": "Agent queue is full"})
+        raise HTTPException(status_code=503, detail="Agent queue is full, retry later")
     return {"task_id": task_id}
 
 
+TERMINAL_STATUSES = ("completed", "failed")
+
+
 @app.get("/task-status/{task_id}")
-def get_status(task_id: str):
-    tasks = load_tasks()
-    return tasks.get(task_id, {"status": "unknown"})
+def get_status(task_id: str, response: Response):
+    task = task_storage.get_task_cached(task_id) or {"status": "unknown"}
+    status = task.get("status", "unknown")
+    # Finished tasks never change again; running ones are worth re-polling every second
+    response.headers["Cache-Control"] = "max-age=3600" if status in TERMINAL_STATUSES else "max-age=1"
+    return {"status": status, "result": task.get("result")}
+
 
+@app.get("/task-result/{task_id}", deprecated=True)
+def get_result(task_id: str, response: Response):
+    """Deprecated alias of /task-status, which now returns the result as well"""
+    return get_status(task_id, response)
 
-@app.get("/task-result/{task_id}")
-def get_result(task_id: str):
-    tasks = load_tasks()
-    task = tasks.get(task_id)
-    if not task:
-        return {"status": "unknown", "result": None}
-    return {
-        "status": task["status"],
-        "result": task["result"]
-    }
 
+# Bare per-repo clones used as --reference object stores for task checkouts
+REPO_CACHE_DIR = os.getenv("REPO_CACHE_DIR", "/app/cache")
+_repo_cache_locks = {}  # owner_repo -> asyncio.Lock serializing cache updates
 
-def run_agent(task_id: str, req: TaskRequest):
+# How much trailing command output a failed task reports in its result
+OUTPUT_TAIL_CHARS = 2000
+# Bytes kept while streaming: enough for the tail in any encoding plus a token straddling its start
+OUTPUT_TAIL_BYTES = 4 * OUTPUT_TAIL_CHARS + len(GITHUB_TOKEN or "")
+
+
+# git options that take their value as the next argument
+GIT_OPTIONS_WITH_VALUE = {"-C", "-c", "--git-dir", "--work-tree"}
+
+
+def command_label(args) -> str:
+    """Name a command for error messages: the git subcommand, or the program itself"""
+    if args[0] != "git":
+        return args[0]
+    rest = list(args[1:])
+    while rest and rest[0].startswith("-"):
+        if rest.pop(0) in GIT_OPTIONS_WITH_VALUE and rest:
+            rest.pop(0)
+    return f"git {rest[0]}" if rest else "git"
+
+
+async def run_command(*args, cwd=None, check=True):
+    """Run a command without blocking the event loop, capturing its output.
+
+    Returns (returncode, output tail). With check set, a non-zero exit raises
+    RuntimeError carrying the tail so it ends up in the task result.
+    """
+    proc = await asyncio.create_subprocess_exec(
+        *args, cwd=cwd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT
+    )
+    # Stream the output so a chatty test suite costs a bounded buffer, not its whole log
+    output = bytearray()
+    try:
+        while chunk := await proc.stdout.read(65536):
+            output += chunk
+            del output[:-OUTPUT_TAIL_BYTES]
+        await proc.wait()
+    except asyncio.CancelledError:
+        # Shutdown cancelled the task; don't leave git or the test suite running in a deleted checkout
+        try:
+            proc.kill()
+        except ProcessLookupError:
+            pass  # Exited on its own just before the cancel
+        await proc.wait()
+        raise
+    tail = output.decode(errors="replace")
+    if GITHUB_TOKEN:
+        tail = tail.replace(GITHUB_TOKEN, "***")
+    tail = tail[-OUTPUT_TAIL_CHARS:]
+    if check and proc.returncode != 0:
+        raise RuntimeError(f"`{command_label(args)}` exited with {proc.returncode}:\n{tail}")
+    return proc.returncode, tail
+
+
+async def github_graphql(query: str, variables: dict, partial: bool = False) -> dict:
+    """POST one GraphQL document to GitHub and return its data, raising on errors.
+
+    With partial=True, errors are only logged and whatever data GitHub did
+    resolve is returned (fields that failed come back as None).
+    """
+    response = await github_client.post(
+        GITHUB_GRAPHQL_PATH,
+        json={"query": query, "variables": variables}
+    )
+    response.raise_for_status()
+    payload = response.json()
+    if payload.get("errors"):
+        message = "GitHub GraphQL error: " + "; ".join(e.get("message", "") for e in payload["errors"])
+        if not partial or not payload.get("data"):
+            raise RuntimeError(message)
+        print(f"[AGENT WARNING] {message}")
+    return payload["data"]
+
+
+# owner_repo -> node ids for the repository and configured labels/reviewers
+_github_node_ids = {}
+
+
+async def github_node_ids(owner_repo: str) -> dict:
+    """Resolve (and cache) the node ids createPullRequest and PR enrichment need"""
+    if owner_repo in _github_node_ids:
+        return _github_node_ids[owner_repo]
+    owner, name = owner_repo.split("/", 1)
+    params = ["$owner: String!", "$name: String!"]
+    variables = {"owner": owner, "name": name}
+    # Look labels up by name so none are missed however many the repository has
+    label_fields = []
+    for i, label in enumerate(GITHUB_PR_LABELS):
+        params.append(f"$label{i}: String!")
+        label_fields.append(f"label{i}: label(name: $label{i}) {{ id }}")
+        variables[f"label{i}"] = label
+    fields = [f"repository(owner: $owner, name: $name) {{ {' '.join(['id', *label_fields])} }}"]
+    for i, login in enumerate(GITHUB_PR_REVIEWERS):
+        params.append(f"$reviewer{i}: String!")
+        fields.append(f"reviewer{i}: user(login: $reviewer{i}) {{ id }}")
+        variables[f"reviewer{i}"] = login
+
+    # An unknown reviewer login is a GraphQL error; tolerate it so only the repository is required
+    data = await github_graphql(f"query({', '.join(params)}) {{ {' '.join(fields)} }}", variables, partial=True)
+    repository = data.get("repository")
+    if not repository:
+        raise RuntimeError(f"GitHub repository {owner_repo} not found")
+
+    ids = {"repository": repository["id"], "labels": [], "reviewers": []}
+    for i, label in enumerate(GITHUB_PR_LABELS):
+        if repository.get(f"label{i}"):
+            ids["labels"].append(repository[f"label{i}"]["id"])
+        else:
+            print(f"[AGENT WARNING] Label '{label}' not found in {owner_repo}, skipping it")
+    for i, login in enumerate(GITHUB_PR_REVIEWERS):
+        if data.get(f"reviewer{i}"):
+            ids["reviewers"].append(data[f"reviewer{i}"]["id"])
+        else:
+            print(f"[AGENT WARNING] Reviewer '{login}' not found, skipping them")
+    _github_node_ids[owner_repo] = ids
+    return ids
+
+
+CREATE_PULL_REQUEST = """
+mutation($input: CreatePullRequestInput!) {
+  createPullRequest(input: $input) { pullRequest { id url } }
+}
+"""
+
+
+async def create_pull_request(req: TaskRequest, head: str) -> str:
+    """Open the PR through GraphQL, then label it and request reviews in one batched mutation"""
+    ids = await github_node_ids(req.owner_repo)
+    data = await github_graphql(CREATE_PULL_REQUEST, {"input": {
+        "repositoryId": ids["repository"],
+        "title": f"Agent PR: {req.prompt[:50]}",
+        "headRefName": head,
+        "baseRefName": req.github_branch,
+        "body": f"Changes proposed by agent for prompt: {req.prompt}",
+    }})
+    pull_request = data["createPullRequest"]["pullRequest"]
+
+    # The PR id only exists after createPullRequest, so enrichment is a second document
+    params, fields, variables = [], [], {}
+    if ids["labels"]:
+        params.append("$labels: AddLabelsToLabelableInput!")
+        fields.append("addLabelsToLabelable(input: $labels) { clientMutationId }")
+        variables["labels"] = {"labelableId": pull_request["id"], "labelIds": ids["labels"]}
+    if ids["reviewers"]:
+        params.append("$reviews: RequestReviewsInput!")
+        fields.append("requestReviews(input: $reviews) { clientMutationId }")
+        variables["reviews"] = {"pullRequestId": pull_request["id"], "userIds": ids["reviewers"]}
+    if fields:
+        # The PR already exists at this point, so a failed label/review request must not fail the task
+        try:
+            await github_graphql(f"mutation({', '.join(params)}) {{ {' '.join(fields)} }}", variables)
+        except Exception as e:
+            print(f"[AGENT WARNING] Could not label or request reviews on {pull_request['url']}: {e}")
+    return pull_request["url"]
+
+
+async def refresh_repo_cache(owner_repo: str, repo_url: str) -> Optional[str]:
+    """Create or fetch the bare cache for owner_repo; None if it is unavailable.
+
+    Task clones copy what they borrow (--dissociate), so an existing cache is
+    never deleted here: a failed refresh just means this task skips it.
+    """
+    cache_dir = os.path.join(REPO_CACHE_DIR, f"{owner_repo}.git")
+    lock = _repo_cache_locks.setdefault(owner_repo, asyncio.Lock())
+    async with lock:
+        if os.path.isdir(cache_dir):
+            try:
+                # Pass the authenticated URL per fetch so the token never lands in the cache's config;
+                # gc.auto=0 keeps the fetch from pruning objects a concurrent clone is still copying
+                await run_command(
+                    "git", "-c", "gc.auto=0", "--git-dir", cache_dir,
+                    "fetch", "--prune", repo_url, "+refs/heads/*:refs/heads/*",
+                )
+                return cache_dir
+            except Exception as e:
+                print(f"[AGENT WARNING] Repo cache refresh failed for {owner_repo}, cloning without it: {e}")
+                return None
+
+        # Build the cache beside its final path and rename it into place, so other
+        # workers only ever see a complete cache (or none at all)
+        parent = os.path.dirname(cache_dir)
+        build_dir = None
+        try:
+            os.makedirs(parent, exist_ok=True)
+            build_dir = tempfile.mkdtemp(prefix=".building_", dir=parent)
+            await run_command("git", "clone", "--bare", repo_url, build_dir)
+            await run_command("git", "--git-dir", build_dir, "remote", "set-url", "origin", GITHUB_REPO_URL_PREFIX + owner_repo)
+            os.rename(build_dir, cache_dir)
+            build_dir = None
+            return cache_dir
+        except Exception as e:
+            if os.path.isdir(cache_dir):
+                return cache_dir  # Another worker finished building it first
+            print(f"[AGENT WARNING] Repo cache unavailable for {owner_repo}, cloning without it: {e}")
+            return None
+        finally:
+            if build_dir is not None:
+                # Only ever our own unfinished copy; a bare clone is big enough to delete off the loop
+                await asyncio.to_thread(shutil.rmtree, build_dir, ignore_errors=True)
+
+
+async def run_agent(task_id: str, req: TaskRequest):
     print(f"[AGENT DEBUG] run_agent called for task {task_id}")
-    tasks = load_tasks()
     try:
         print(f"[AGENT] Starting task: {task_id}")
 
-        github_token = os.getenv("GITHUB_TOKEN")
-        if not github_token:
+        if not GITHUB_TOKEN:
             raise EnvironmentError("GITHUB_TOKEN is not set")
 
-        if req.test_command:
+        test_args = req.test_args
+        if test_args:
             print(f"[AGENT] Checking if test command exists: {req.test_command}")
-            binary = req.test_command.split()[0]
+            binary = test_args[0]
             if shutil.which(binary) is None:
                 print(f"[AGENT WARNING] Test command '{binary}' not found. Using fallback: 'echo Test command not available, skipping tests'")
-                req.test_command = "echo 'Test command not available, skipping tests'"
-
-        repo_dir = f"/tmp/repo_{task_id}"
-        os.makedirs(repo_dir, exist_ok=True)
-        print(f"[AGENT] Cloning into {repo_dir}")
+                test_args = ("echo", "Test command not available, skipping tests")
 
-        repo_url = req.github_repo_url.replace("https://", f"https://{github_token}@")
-        subprocess.run(["git", "clone", repo_url, repo_dir], check=True)
-        subprocess.run(["git", "checkout", req.github_branch], cwd=repo_dir, check=True)
-        
-        # Configure git user (required for commits)
-        subprocess.run(["git", "config", "user.name", "Jules Agent"], cwd=repo_dir, check=True)
-        subprocess.run(["git", "config", "user.email", "jules-agent@example.com"], cwd=repo_dir, check=True)
-
-        new_branch = f"jules-agent-{task_id[:8]}"
-        subprocess.run(["git", "checkout", "-b", new_branch], cwd=repo_dir, check=True)
-
-        print(f"[AGENT] Modifying README.md")
-        with open(os.path.join(repo_dir, "README.md"), "a") as f:
-            f.write(f"\n\n# Agent Change: {req.prompt}\n")
-
-        if req.test_command:
-            print(f"[AGENT] Running tests: {req.test_command}")
-            test_result = subprocess.run(req.test_command.split(), cwd=repo_dir)
-            if test_result.returncode != 0:
-                raise RuntimeError("Tests failed. Aborting push.")
-
-        print(f"[AGENT] Committing changes")
-        subprocess.run(["git", "add", "README.md"], cwd=repo_dir, check=True)
-        subprocess.run(["git", "commit", "-m", f"Agent: {req.prompt}"], cwd=repo_dir, check=True)
-        subprocess.run(["git", "push", "origin", new_branch], cwd=repo_dir, check=True)
-
-        print(f"[AGENT] Creating PR")
-        owner_repo = req.github_repo_url.rstrip(".git").split("github.com/")[-1]
-        pr_data = {
-            "title": f"Agent PR: {req.prompt[:50]}",
-            "head": new_branch,
-            "base": req.github_branch,
-            "body": f"Changes proposed by agent for prompt: {req.prompt}"
-        }
-        response = requests.post(
-            f"https://api.github.com/repos/{owner_repo}/pulls",
-            headers={"Authorization": f"token {github_token}"},
-            json=pr_data
-        )
-        response.raise_for_status()
-
-        tasks[task_id] = {
-            "status": "completed",
-            "result": f"Pull request created: {response.json().get('html_url')}"
-        }
+        repo_dir = tempfile.mkdtemp(prefix=f"jules_{task_id[:8]}_")
+        try:
+            repo_url = req.github_repo_url.replace("https://", f"https://{GITHUB_TOKEN}@")
+            cache_dir = await refresh_repo_cache(req.owner_repo, repo_url)
+            reference = ["--reference", cache_dir, "--dissociate"] if cache_dir else []
+
+            print(f"[AGENT] Cloning into {repo_dir}")
+            await run_command(
+                "git", "clone", *reference, "--depth=1", "--single-branch", "--branch", req.github_branch,
+                repo_url, repo_dir,
+            )
+
+            # Configure git user (required for commits)
+            await run_command("git", "config", "user.name", "Jules Agent", cwd=repo_dir)
+            await run_command("git", "config", "user.email", "jules-agent@example.com", cwd=repo_dir)
+
+            new_branch = f"jules-agent-{task_id[:8]}"
+            await run_command("git", "checkout", "-b", new_branch, cwd=repo_dir)
+
+            print(f"[AGENT] Modifying README.md")
+            with open(os.path.join(repo_dir, "README.md"), "a") as f:
+                f.write(f"\n\n# Agent Change: {req.prompt}\n")
+
+            if test_args:
+                print(f"[AGENT] Running tests: {' '.join(test_args)}")
+                returncode, output = await run_command(*test_args, cwd=repo_dir, check=False)
+                if returncode != 0:
+                    raise RuntimeError(f"Tests failed. Aborting push.\n{output}")
+
+            print(f"[AGENT] Committing changes")
+            await run_command("git", "add", "README.md", cwd=repo_dir)
+            # Nothing staged means git commit would exit 128; finish cleanly instead
+            returncode, _ = await run_command("git", "diff", "--cached", "--quiet", cwd=repo_dir, check=False)
+            if returncode == 0:
+                print(f"[AGENT] No changes to commit for task {task_id}")
+                await asyncio.to_thread(task_storage.upsert, task_id, {"status": "completed", "result": "no-op: no changes"})
+                return
+            await run_command("git", "commit", "-m", f"Agent: {req.prompt}", cwd=repo_dir)
+            await run_command("git", "push", "origin", new_branch, cwd=repo_dir)
+
+            print(f"[AGENT] Creating PR")
+            pr_url = await create_pull_request(req, new_branch)
+
+            await asyncio.to_thread(task_storage.upsert, task_id, {
+                "status": "completed",
+                "result": f"Pull request created: {pr_url}"
+            })
+        finally:
+            # Deleting a whole checkout is slow on big repos; keep it off the event loop
+            await asyncio.to_thread(shutil.rmtree, repo_dir, ignore_errors=True)
 
     except Exception as e:
         print(f"[AGENT ERROR] Task {task_id} failed: {str(e)}")
-        tasks[task_id] = {"status": "failed", "result": str(e)}
+        await asyncio.to_thread(task_storage.upsert, task_id, {"status": "failed", "result": str(e)})
 
-    save_tasks(tasks)
+
+@app.get("/tasks/export.json")
+def export_tasks():
+    """Dump every stored task as JSON (debugging aid; not for polling)"""
+    return task_storage.load_tasks()
 
 
 @app.get("/")
 def health_check():
-    return {"status": "ok"}
+    return {"status": "ok", "queue_depth": AGENT_QUEUE.qsize() if AGENT_QUEUE is not None else 0}
 
 
 if __name__ == "__main__":
@@ -27,7 +27,7 @@ def run_diagnostic_test():
     
     # Start task
     response = requests.post(f"{LIVE_API_URL}/start-task", json=payload)
-    if response.status_code != 200:
+    if response.status_code not in (200, 202):
         print(f"❌ Failed to start task: {response.status_code} - {response.text}")
         return
     
@@ -45,27 +45,25 @@ def run_diagnostic_test():
             print(f"Status: {status}")
             
             if status in ["completed", "failed"]:
-                # Get detailed result
-                result_response = requests.get(f"{LIVE_API_URL}/task-result/{task_id}")
-                if result_response.status_code == 200:
-                    result = result_response.json()
-                    print(f"\n📋 FINAL RESULT:")
-                    print(f"Status: {result.get('status')}")
-                    print(f"Result: {result.get('result')}")
+                # /task-status includes the result once the task finishes
+                result = status_response.json()
+                print(f"\n📋 FINAL RESULT:")
+                print(f"Status: {result.get('status')}")
+                print(f"Result: {result.get('result')}")
+                
+                # Analyze the error
+                if "git commit" in str(result.get('result', '')):
+                    print(f"\n🔍 ANALYSIS:")
+                    print("The error is occurring during git commit.")
+                    print("Exit status 128 typically means:")
+                    print("- Git user.name and user.email are not configured")
+                    print("- Or there are no changes to commit")
+                    print("- Or there's a permissions issue")
                     
-                    # Analyze the error
-                    if "git commit" in str(result.get('result', '')):
-                        print(f"\n🔍 ANALYSIS:")
-                        print("The error is occurring during git commit.")
-                        print("Exit status 128 typically means:")
-                        print("- Git user.name and user.email are not configured")
-                        print("- Or there are no changes to commit")
-                        print("- Or there's a permissions issue")
-                        
-                        print(f"\n💡 RECOMMENDATIONS:")
-                        print("1. Configure git user in the Docker container")
-                        print("2. Add error handling for empty commits")
-                        print("3. Add better logging for git operations")
+                    print(f"\n💡 RECOMMENDATIONS:")
+                    print("1. Configure git user in the Docker container")
+                    print("2. Add error handling for empty commits")
+                    print("3. Add better logging for git operations")
                 break
         else:
             print(f"Status check failed: {status_response.status_code}")
@@ -52,7 +52,7 @@ class JulesAgentTester:
         
         try:
             response = self.session.post(f"{self.base_url}/start-task", json=payload)
-            if response.status_code == 200:
+            if response.status_code in (200, 202):
                 result = response.json()
                 task_id = result.get("task_id")
                 print(f"✅ Task started with ID: {task_id}")
@@ -102,7 +102,7 @@ class JulesAgentTester:
             print(f"📊 Status: {current_status}")
             
             if current_status in ["completed", "failed"]:
-                result = self.get_task_result(task_id)
+                result = status  # /task-status includes the result once finished
                 if current_status == "completed":
                     print(f"✅ Task completed successfully!")
                     print(f"🔗 Result: {result.get('result', 'No result')}")
@@ -189,7 +189,7 @@ def simulate_n8n_workflow():
     # 1. HTTP Request node calls /start-task
     # 2. Wait node delays for a few seconds
     # 3. Loop with HTTP Request to check /task-status
-    # 4. When complete, HTTP Request to get /task-result
+    # 4. When complete, use the result returned by the final /task-status
     
     tester = JulesAgentTester()
     
@@ -231,8 +231,8 @@ def simulate_n8n_workflow():
         current_status = status.get("status", "unknown")
         
         if current_status in ["completed", "failed"]:
-            print("Step 4: n8n HTTP Request - Get final result")
-            result = tester.get_task_result(task_id)
+            print("Step 4: n8n reads the final result from the status response")
+            result = status
             
             if current_status == "completed":
                 print("✅ n8n workflow would complete successfully")
@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+"""
+TaskRequest validation tests
+"""
+
+import os
+import sys
+import unittest
+
+os.environ.setdefault("STORAGE_TYPE", "memory")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pydantic import ValidationError  # noqa: E402
+
+from main import TaskRequest  # noqa: E402
+
+
+def task_request(url: str, **fields) -> TaskRequest:
+    return TaskRequest(prompt="p", github_repo_url=url, **fields)
+
+
+class TaskRequestTest(unittest.TestCase):
+    def test_owner_repo_is_parsed_from_the_url(self):
+        cases = {
+            "https://github.com/owner/repo": "owner/repo",
+            "https://github.com/owner/repo.git": "owner/repo",
+            "https://github.com/owner/repo/": "owner/repo",
+            "https://github.com/owner/foo.bar.git": "owner/foo.bar",
+            "https://github.com/my-org/repo_name": "my-org/repo_name",
+        }
+        for url, owner_repo in cases.items():
+            with self.subTest(url=url):
+                self.assertEqual(task_request(url).owner_repo, owner_repo)
+
+    def test_invalid_urls_are_rejected(self):
+        for url in [
+            "http://github.com/owner/repo",
+            "https://gitlab.com/owner/repo",
+            "https://github.com/owner",
+            "https://github.com/owner/repo/tree/main",
+            "https://github.com/../tmp",
+            "https://github.com/owner/..",
+            "https://github.com/owner/.git",
+            "https://github.com/owner/re po",
+        ]:
+            with self.subTest(url=url):
+                with self.assertRaises(ValidationError):
+                    task_request(url)
+
+    def test_test_command_is_split_once(self):
+        self.assertEqual(task_request("https://github.com/o/r", test_command="pytest -q").test_args, ("pytest", "-q"))
+        self.assertEqual(task_request("https://github.com/o/r").test_args, ())
+
+
+if __name__ == "__main__":
+    unittest.main()